@@ -1,43 +1,92 @@
-import configparser
+import functools
+import re
 from pathlib import Path
 
+SLOT_SIZE = 4  # bytes per AI slot
+SECTION_RE = re.compile(r"^[ \t]*\[(.+?)\][ \t]*$", re.MULTILINE)
+
+def ai_offset(ai_tag: str, slot_size: int = SLOT_SIZE) -> tuple:
+    """Return the inclusive (start, end) byte offsets of an AI slot tag like 'AI5'."""
+    start = (int(ai_tag[2:]) - 1) * slot_size
+    return start, start + slot_size - 1
+
+def _strip_comment(line: str) -> str:
+    """Remove a trailing '$' comment that is not inside a quoted string."""
+    in_quotes = False
+    for i, ch in enumerate(line):
+        if ch == '"':
+            in_quotes = not in_quotes
+        elif ch == "$" and not in_quotes:
+            return line[:i].rstrip()
+    return line
+
+def scan_eds(text: str) -> dict:
+    """
+    Single-pass scan of EDS text into {section: {key: value}}.
+    Entries run until their terminating ';', which is stripped from the value.
+    """
+    parts = SECTION_RE.split(text)
+    sections = {}
+    # parts[0] is the comment header before the first section
+    for name, body in zip(parts[1::2], parts[2::2]):
+        entries = sections.setdefault(name.strip(), {})
+        key = None
+        for line in body.splitlines():
+            line = line.strip()
+            if "$" in line:
+                line = _strip_comment(line)
+            if not line:
+                continue
+            if key is not None:
+                # Continuation of a multi-line entry
+                entries[key] = f"{entries[key]}\n{line}" if entries[key] else line
+            elif "=" in line:
+                key, value = line.split("=", 1)
+                key = key.strip()
+                entries[key] = value.strip()
+            else:
+                continue
+            if entries[key].endswith(";"):
+                entries[key] = entries[key][:-1].rstrip()
+                key = None
+    return sections
+
+@functools.lru_cache(maxsize=8)
 def parse_eds(file_path: str) -> dict:
     """
-    Parse EDS file and return device configuration including assembly info and offsets.
+    Parse EDS file and return device configuration including assembly info and slot layout.
+    The result is memoized per path and shared between callers, so treat it as read-only.
     """
-    config = configparser.ConfigParser(strict=False)
-    config.optionxform = str  # preserve case
-    config.read(file_path)
+    try:
+        with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+            sections = scan_eds(f.read())
+    except OSError:
+        sections = {} # Missing file: fall back to defaults
 
+    device = sections.get("Device", {})
     device_info = {
-        "Vendor": config.get("Device", "Vendor", fallback="Unknown"),
-        "ProductName": config.get("Device", "Product Name", fallback="Unknown"),
-        "Revision": config.get("Device", "Revision", fallback="Unknown"),
+        "Vendor": device.get("Vendor", "Unknown"),
+        "ProductName": device.get("Product Name", "Unknown"),
+        "Revision": device.get("Revision", "Unknown"),
         "IPAddress": "192.168.178.237"
     }
 
     # Extract Assembly info
     assemblies = {}
-    for section in config.sections():
+    for section, entries in sections.items():
         if section.startswith("Assembly"):
-            assemblies[section] = dict(config.items(section))
+            assemblies[section] = dict(entries)
 
-    # Calculate offsets for AI slots (4 bytes per slot)
+    # AI slots are laid out back to back (4 bytes per slot), see ai_offset()
     # Assume Input Assembly size is given in EDS or default to 128 bytes for 4-channel block
     input_size = int(assemblies.get("Assembly 100", {}).get("Size", 128))  # Example: Assembly 100 = Input
-    slot_size = 4  # bytes per AI slot
-    num_slots = input_size // slot_size
-
-    offsets = {}
-    for i in range(1, num_slots + 1):
-        start = (i - 1) * slot_size
-        end = start + slot_size - 1
-        offsets[f"AI{i}"] = (start, end)
 
     return {
         "device_info": device_info,
         "assemblies": assemblies,
-        "offsets": offsets
+        "input_size": input_size,
+        "slot_size": SLOT_SIZE,
+        "num_slots": input_size // SLOT_SIZE
     }
 
 if __name__ == "__main__":
@@ -45,4 +94,4 @@ if __name__ == "__main__":
     parsed = parse_eds(str(eds_file))
     print("Device Info:", parsed["device_info"])
     print("Assemblies:", parsed["assemblies"])
-    print("Offsets:", parsed["offsets"])
\ No newline at end of file
+    print("Input size:", parsed["input_size"], "bytes /", parsed["num_slots"], "AI slots")
\ No newline at end of file
@@ -1,16 +1,89 @@
+import asyncio
+import concurrent.futures
 import logging
 import time
 import struct
-from typing import Dict, Tuple, Optional
+from operator import itemgetter
+from typing import Callable, Dict, List, Tuple, Optional, Union
 
 from pycomm3 import CIPDriver
-from eds_parser import parse_eds
+from eds_parser import SLOT_SIZE, parse_eds, ai_offset
+from retry import retry_with_backoff
+
+# Vorkompilierte Formate für die 4-Byte-Slots des Input-Assemblys (little-endian)
+_F32 = struct.Struct('<f')
+_U32 = struct.Struct('<L')
+
+# Alle Dekodierpfade lesen per unpack_from direkt aus dem Puffer, ohne Slice-Kopien
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+def _build_status_bits(status_enum: Dict[int, str]) -> Tuple[Optional[str], ...]:
+    """Bildet das Status-Enum auf ein Tupel Bit -> Beschreibung ab (genau 32 Einträge)."""
+    invalid = [bit for bit in status_enum if not 0 <= bit < 32]
+    if invalid:
+        raise ValueError(f"Status bits outside of a 32-bit word: {invalid}")
+    return tuple(status_enum.get(bit) for bit in range(32))
+
+
+def _build_status_byte_tables(status_bits: Tuple[Optional[str], ...]) -> Tuple[Tuple[Tuple[str, ...], ...], ...]:
+    """Baut je Byte des 32-Bit-Status-Worts eine Tabelle Bytewert -> Beschreibungen der gesetzten Bits."""
+    tables = []
+    for byte_idx in range(4):
+        table = []
+        for value in range(256):
+            active = []
+            # Nur über gesetzte Bits iterieren (niedrigstes Bit isolieren und löschen)
+            while value:
+                low = value & -value
+                description = status_bits[byte_idx * 8 + low.bit_length() - 1]
+                if description is not None:
+                    active.append(description)
+                value ^= low
+            table.append(tuple(active))
+        tables.append(tuple(table))
+    return tuple(tables)
+
+
+def _build_gather(slots: List[int]) -> Callable[[Tuple], Tuple]:
+    """Liefert eine Funktion, die die gegebenen Slots eines dekodierten Blocks als Tupel herausgreift."""
+    if not slots:
+        return lambda values: ()
+    if len(slots) == 1:
+        slot = slots[0]
+        return lambda values: (values[slot],)
+    return itemgetter(*slots)
+
+
+def _build_assembly_layout(fields: List[Tuple[int, str]]) -> Tuple[struct.Struct, Dict[int, int]]:
+    """Baut ein Struct, das alle benötigten Felder in einem einzigen unpack_from dekodiert.
+
+    Args:
+        fields: (Byte-Offset, Formatzeichen) je Feld; Lücken zwischen den Feldern werden
+            als Pad-Bytes übersprungen.
+
+    Returns:
+        Das Struct und die Zuordnung Byte-Offset -> Position im Ergebnistupel.
+    """
+    fmt = ["<"]
+    position: Dict[int, int] = {}
+    next_offset = 0
+    for offset, code in sorted(set(fields)):
+        if offset < next_offset:
+            raise ValueError(f"Field at byte {offset} overlaps the previous field")
+        if offset > next_offset:
+            fmt.append(f"{offset - next_offset}x")
+        fmt.append(code)
+        position[offset] = len(position)
+        next_offset = offset + struct.calcsize("<" + code)
+    return struct.Struct("".join(fmt)), position
 
 
 class EtherIPClient:
     """
-    EtherNet/IP-Client, der ausschließlich **unverbundene** (UCMM) CIP-Nachrichten nutzt.
-    Keine Forward-Open/connected messaging. IP kommt aus einer Config.
+    EtherNet/IP-Client, der standardmäßig **unverbundene** (UCMM) CIP-Nachrichten nutzt.
+    Optional wird das zyklische Lesen des Input-Assemblys über eine Forward-Open-Verbindung
+    (Class 3, connected explicit messaging) abgewickelt. IP kommt aus einer Config.
     """
 
     STATUS_ENUM: Dict[int, str] = {
@@ -27,20 +100,34 @@ class EtherIPClient:
         31: "Sensor Status bit15"
     }
 
-    def __init__(self, ip_address: str, eds_file: str, timeout: float = 5.0):
+    # Vorberechnete Lookup-Tabellen: 4 Tabellenzugriffe statt 32 Bit-Tests pro Status-Wort
+    _STATUS_BITS = _build_status_bits(STATUS_ENUM)
+    _STATUS_BYTE_TABLES = _build_status_byte_tables(_STATUS_BITS)
+
+    def __init__(self, ip_address: str, eds_file: str, timeout: float = 5.0, connected_messaging: bool = False,
+                 read_cache_ms: float = 0):
         """Initialisiert den Client.
 
         Args:
             ip_address: IP-Adresse des Geräts.
             eds_file: Pfad zur EDS-Datei.
             timeout: Socket-Timeout (Sek.).
+            connected_messaging: Input-Assembly als Class-3-Nachricht (SendUnitData) über eine
+                Forward-Open-Verbindung lesen statt unverbunden per SendRRData. Das Forward Open
+                baut pycomm3 beim ersten verbundenen Request auf; connect() prüft es sofort.
+            read_cache_ms: Gültigkeitsdauer (ms) eines gelesenen Assemblys; innerhalb dieser
+                Zeit beantworten read_* die Anfrage ohne erneuten CIP-Request. 0 (Standard)
+                schaltet ab; nützlich nur für Aufrufer, die read_* kurz hintereinander aufrufen.
         """
         parsed = parse_eds(eds_file)
         self.device_info = parsed.get("device_info", {})
-        self.offsets: Dict[str, Tuple[int, int]] = parsed.get("offsets", {})
+        self.num_slots: int = parsed.get("num_slots", 0)
+        self.slot_size: int = parsed.get("slot_size", SLOT_SIZE)
 
         self.ip_address = ip_address
         self.timeout = timeout
+        self.connected_messaging = connected_messaging
+        self.read_cache_ttl = max(read_cache_ms, 0) / 1000.0
 
         self.driver: Optional[CIPDriver] = None
         self.reconnect_attempts = 0
@@ -58,6 +145,43 @@ class EtherIPClient:
             "temperature_ch4": "AI22",
         }
 
+        # Zuordnung der Status-Wörter zu AI-Slots
+        self.status_mappings = {
+            "status_ch1": "AI15",
+            "status_ch2": "AI16",
+            "status_ch3": "AI26",
+            "status_ch4": "AI27",
+        }
+
+        # AI-Tags einmalig über ai_offset() in (Name, Byte-Offset)-Pläne auflösen.
+        self._float_plan = self._build_plan(self.channels)
+        self._status_plan = self._build_plan(self.status_mappings)
+        # Ein gemeinsames Layout für Messwerte und Status-Wörter: pro Poll ein einziges
+        # unpack_from über das Assembly, danach nur noch ein itemgetter-Gather je Sicht.
+        self._layout, position = _build_assembly_layout(
+            [(i, 'f') for _, i in self._float_plan] + [(i, 'L') for _, i in self._status_plan]
+        )
+        self._float_names = [name for name, _ in self._float_plan]
+        self._float_gather = _build_gather([position[i] for _, i in self._float_plan])
+        self._status_names = [name for name, _ in self._status_plan]
+        self._status_gather = _build_gather([position[i] for _, i in self._status_plan])
+        # Einmalige Längenprüfung beim Empfang statt Prüfungen je Feld
+        self._min_rx_len = self._layout.size
+        # TTL-Cache des zuletzt dekodierten Assemblys: (Zeitpunkt monotonic, Werte-Tupel)
+        self._cached_values: Optional[Tuple] = None
+        self._cached_at = 0.0
+
+    def _build_plan(self, mapping: Dict[str, str]) -> List[Tuple[str, int]]:
+        """Löst AI-Tags in (Name, Byte-Offset)-Paare auf, begrenzt auf die Slots laut EDS."""
+        plan = []
+        for name, ai_tag in mapping.items():
+            start, end = ai_offset(ai_tag, self.slot_size)
+            if 0 <= start and end < self.num_slots * self.slot_size:
+                plan.append((name, start))
+            else:
+                logging.warning(f"{ai_tag} ({name}) lies outside the input assembly; value will always be None.")
+        return plan
+
     # --- Hilfsfunktion: garantiert unverbundene CIP-Nachrichten ---
     def gm_unconnected(self, **kwargs):
         """Wrapper für generic_message(), der immer unconnected sendet."""
@@ -65,8 +189,14 @@ class EtherIPClient:
             raise RuntimeError("Driver ist nicht initialisiert.")
         return self.driver.generic_message(connected=False, **kwargs)
 
+    def gm_cyclic(self, **kwargs):
+        """Wrapper für generic_message() der zyklischen Reads: connected, falls konfiguriert."""
+        if not self.driver:
+            raise RuntimeError("Driver ist nicht initialisiert.")
+        return self.driver.generic_message(connected=self.connected_messaging, **kwargs)
+
     def connect(self) -> bool:
-        """Verbindet sich mit dem Gerät mit Backoff-Strategie (nur UCMM)."""
+        """Verbindet sich mit dem Gerät mit Backoff-Strategie (Session-Aufbau per UCMM)."""
         current_time = time.time()
 
         # Bereits verbunden?
@@ -89,25 +219,34 @@ class EtherIPClient:
         logging.info(f"Attempting to connect to EtherNet/IP device at {self.ip_address} (Attempt {self.reconnect_attempts})...")
 
         try:
-            # Keine Route/Slot/RPI, kein connected messaging
-            self.driver = CIPDriver(self.ip_address, timeout=self.timeout, init_forward_open=False)
+            # Keine Route/Slot/RPI
+            self.driver = CIPDriver(self.ip_address, timeout=self.timeout)
             connection_successful = self.driver.open()
 
             if connection_successful:
-                logging.info(
-                    f"Successfully connected to EtherNet/IP device at {self.ip_address} after {self.reconnect_attempts} attempts."
-                )
-                self.reconnect_attempts = 0
-                self.last_reconnect_time = 0
-
-                # Unconnected Verification: Identity lesen
-                resp = self.gm_unconnected(
+                # Verifikation: Identity lesen, auf demselben Weg wie die zyklischen Reads.
+                # Bei connected messaging baut dieser Request das Forward Open auf.
+                resp = self.gm_cyclic(
                     service=0x0E,  # Get_Attribute_Single
                     class_code=0x01,  # Identity Object
                     instance=1,
                     attribute=1,
                 )
                 logging.info(f"Identity/1/1 response: {resp}")
+                if self.connected_messaging and not resp:
+                    # Ohne funktionierendes Forward Open würde jeder Poll scheitern, während
+                    # driver.connected True bleibt und nie ein Reconnect ausgelöst wird
+                    logging.error(
+                        f"Connected messaging to {self.ip_address} failed (Attempt {self.reconnect_attempts}): {getattr(resp, 'error', resp)}."
+                    )
+                    self.close()
+                    return False
+
+                logging.info(
+                    f"Successfully connected to EtherNet/IP device at {self.ip_address} after {self.reconnect_attempts} attempts."
+                )
+                self.reconnect_attempts = 0
+                self.last_reconnect_time = 0
                 return True
 
             else:
@@ -125,15 +264,42 @@ class EtherIPClient:
             self.driver = None
             return False
 
+    async def connect_with_backoff(self, stop_event: asyncio.Event,
+                                   executor: Optional[concurrent.futures.Executor] = None) -> bool:
+        """Verbindet mit exponentiellem Backoff (siehe retry.retry_with_backoff), bis es klappt.
+
+        Das blockierende connect() läuft im angegebenen Executor (Standard: Default-Executor).
+        Liefert False, wenn stop_event vorher gesetzt wird.
+        """
+        loop = asyncio.get_running_loop()
+
+        def attempt() -> bool:
+            # Der Backoff bestimmt hier den Takt, nicht die Versuchssperre in connect()
+            self.last_reconnect_time = 0.0
+            return self.connect()
+
+        return await retry_with_backoff(lambda: loop.run_in_executor(executor, attempt), stop_event,
+                                        f"EtherNet/IP device at {self.ip_address}")
+
+    def close(self) -> None:
+        """Schließt die Verbindung zum Gerät und verwirft Driver und gecachte Werte."""
+        driver, self.driver = self.driver, None
+        self._cached_values = None
+        if driver is not None:
+            try:
+                driver.close()
+            except Exception as e:
+                logging.warning(f"Error while closing EtherNet/IP connection to {self.ip_address}: {e}")
+
     def read_raw_input(self) -> Optional[bytes]:
-        """Liest das komplette Input-Assembly (Instance 101, Attr 3) als Bytes via UCMM."""
+        """Liest das komplette Input-Assembly (Instance 101, Attr 3) als Bytes (UCMM oder connected)."""
         if not self.driver or not self.driver.connected:
             if not self.connect():
                 logging.error("Driver not connected and failed to reconnect.")
                 return None
 
         try:
-            result = self.gm_unconnected(
+            result = self.gm_cyclic(
                 service=0x0E,           # Get_Attribute_Single
                 class_code=0x04,        # Assembly Object
                 instance=101,           # Input 2 Block_AI_DI Format (4-Kanal-Version)
@@ -141,7 +307,11 @@ class EtherIPClient:
             )
             if result and getattr(result, 'value', None):
                 raw_bytes = result.value
-                logging.debug(f"Raw input length: {len(raw_bytes)} bytes")
+                n = len(raw_bytes)
+                logging.debug("Raw input length: %d bytes", n)
+                if n < self._min_rx_len:
+                    logging.error(f"Input assembly too short: {n} bytes, expected at least {self._min_rx_len}")
+                    return None
                 return raw_bytes
             else:
                 err = getattr(result, 'error', None) if result else 'No response'
@@ -152,76 +322,82 @@ class EtherIPClient:
             return None
 
     @staticmethod
-    def decode_float(raw_bytes: bytes, start: int, end: int) -> Optional[float]:
+    def decode_float(raw_bytes: Buffer, start: int, end: int) -> Optional[float]:
         """Dekodiert 4 Bytes (little-endian) zu float.
         Erwartet genau 4 Bytes: Indizes inklusiv (start..end)."""
         try:
-            segment = raw_bytes[start:end+1]
-            if len(segment) != 4:
-                raise ValueError(f"Float segment length must be 4, got {len(segment)}")
-            return struct.unpack('<f', segment)[0]
+            if end - start + 1 != _F32.size:
+                raise ValueError(f"Float segment length must be 4, got {end - start + 1}")
+            return _F32.unpack_from(raw_bytes, start)[0]
         except Exception as e:
             logging.error(f"Error decoding bytes {start}-{end} as float: {e}")
             return None
 
     @staticmethod
-    def decode_uint(raw_bytes: bytes, start: int, end: int) -> Optional[int]:
+    def decode_uint(raw_bytes: Buffer, start: int, end: int) -> Optional[int]:
         """Dekodiert 4 Bytes (little-endian) zu unsigned int (32 Bit)."""
         try:
-            segment = raw_bytes[start:end+1]
-            if len(segment) != 4:
-                raise ValueError(f"Uint segment length must be 4, got {len(segment)}")
-            return struct.unpack('<L', segment)[0]
+            if end - start + 1 != _U32.size:
+                raise ValueError(f"Uint segment length must be 4, got {end - start + 1}")
+            return _U32.unpack_from(raw_bytes, start)[0]
         except Exception as e:
             logging.error(f"Error decoding bytes {start}-{end} as uint: {e}")
             return None
 
+    def _read_values(self) -> Optional[Tuple]:
+        """Liest das Input-Assembly einmal und entpackt alle benötigten Slots (None bei Fehler).
+
+        Liegt der letzte erfolgreiche Read weniger als read_cache_ms zurück, werden die
+        zwischengespeicherten Werte verwendet, ohne das Gerät erneut anzufragen.
+        """
+        values = self._cached_values
+        # Bei abgeschaltetem Cache bleibt _cached_values None: keine Uhrabfrage pro Poll
+        if values is None or time.monotonic() - self._cached_at >= self.read_cache_ttl:
+            raw_bytes = self.read_raw_input()
+            if not raw_bytes:
+                # Fehlschläge werden nicht gecacht, damit der nächste Aufruf sofort neu liest
+                self._cached_values = None
+                return None
+            values = self._layout.unpack_from(raw_bytes)
+            if self.read_cache_ttl:
+                self._cached_values, self._cached_at = values, time.monotonic()
+        return values
+
+    def read_all(self) -> Tuple[Dict[str, Optional[float]], Dict[str, Optional[str]]]:
+        """Liest das Input-Assembly einmal und dekodiert Messwerte und Status daraus."""
+        values = self._read_values()
+        if values is None:
+            return {}, {}
+        return self._readings_from(values), self._statuses_from(values)
+
     def read_all_channels(self) -> Dict[str, Optional[float]]:
-        """Liest alle Messkanäle anhand der EDS-Offsets."""
-        raw_bytes = self.read_raw_input()
-        if not raw_bytes:
-            return {}
-
-        readings: Dict[str, Optional[float]] = {}
-        for name, ai_tag in self.channels.items():
-            start, end = self.offsets.get(ai_tag, (None, None))
-            if start is not None and end is not None and end < len(raw_bytes):
-                value = self.decode_float(raw_bytes, start, end)
-                readings[name] = value
-            else:
-                readings[name] = None
-        return readings
+        """Liest alle Messkanäle aus dem Input-Assembly (ohne die Status-Wörter zu dekodieren)."""
+        values = self._read_values()
+        return {} if values is None else self._readings_from(values)
 
     def read_channel_statuses(self) -> Dict[str, Optional[str]]:
-        """Liest und dekodiert die Status-Wörter der Kanäle."""
-        raw_bytes = self.read_raw_input()
-        if not raw_bytes:
-            return {}
+        """Liest und dekodiert die Status-Wörter der Kanäle (ohne die Messwerte zuzuordnen)."""
+        values = self._read_values()
+        return {} if values is None else self._statuses_from(values)
 
-        statuses: Dict[str, Optional[str]] = {}
-        status_mappings = {
-            "status_ch1": "AI15",
-            "status_ch2": "AI16",
-            "status_ch3": "AI26",
-            "status_ch4": "AI27",
-        }
-        for name, ai_tag in status_mappings.items():
-            start, end = self.offsets.get(ai_tag, (None, None))
-            if start is not None and end is not None and end < len(raw_bytes):
-                status_value = self.decode_uint(raw_bytes, start, end)
-                if status_value is None:
-                    statuses[name] = None
-                    continue
-                if status_value == 0:
-                    statuses[name] = "okay"
-                else:
-                    active = []
-                    for bit, description in self.STATUS_ENUM.items():
-                        if (status_value >> bit) & 1:
-                            active.append(description)
-                    statuses[name] = ", ".join(active) if active else "okay"
+    def _readings_from(self, values: Tuple) -> Dict[str, Optional[float]]:
+        """Ordnet die dekodierten Float-Slots den Messkanälen zu."""
+        readings: Dict[str, Optional[float]] = dict.fromkeys(self.channels)
+        readings.update(zip(self._float_names, self._float_gather(values)))
+        return readings
+
+    def _statuses_from(self, values: Tuple) -> Dict[str, Optional[str]]:
+        """Übersetzt die dekodierten Status-Wörter in Klartext."""
+        statuses: Dict[str, Optional[str]] = dict.fromkeys(self.status_mappings)
+        words = self._status_gather(values)
+        t0, t1, t2, t3 = self._STATUS_BYTE_TABLES
+        for name, status_value in zip(self._status_names, words):
+            if status_value == 0:
+                statuses[name] = "okay"
             else:
-                statuses[name] = None
+                active = (t0[status_value & 0xFF] + t1[(status_value >> 8) & 0xFF]
+                          + t2[(status_value >> 16) & 0xFF] + t3[status_value >> 24])
+                statuses[name] = ", ".join(active) or "okay"
         return statuses
 
     def health_check_loop(self, interval: int = 5):
@@ -230,14 +406,10 @@ class EtherIPClient:
         try:
             while True:
                 readings = self.read_all_channels()
-                logging.info(f"Current readings: {readings}")
+                logging.info("Current readings: %s", readings)
                 time.sleep(interval)
         except KeyboardInterrupt:
             logging.info("Health check loop interrupted by user.")
         finally:
             # Sauber schließen
-            try:
-                if self.driver:
-                    self.driver.close()
-            except Exception:
-                pass
\ No newline at end of file
+            self.close()
\ No newline at end of file
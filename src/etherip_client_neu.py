@@ -4,10 +4,10 @@ import time
 import struct
 import json
 import os
-from typing import Dict, Tuple, Optional
+from typing import Dict, Optional
 
 from pycomm3 import CIPDriver
-from eds_parser import parse_eds
+from eds_parser import SLOT_SIZE, parse_eds, ai_offset
 
 
 class EtherIPClient:
@@ -40,7 +40,8 @@ class EtherIPClient:
         """
         parsed = parse_eds(eds_file)
         self.device_info = parsed.get("device_info", {})
-        self.offsets: Dict[str, Tuple[int, int]] = parsed.get("offsets", {})
+        self.num_slots: int = parsed.get("num_slots", 0)
+        self.slot_size: int = parsed.get("slot_size", SLOT_SIZE)
 
         self.ip_address = ip_address
         self.timeout = timeout
@@ -144,7 +145,7 @@ class EtherIPClient:
             )
             if result and getattr(result, 'value', None):
                 raw_bytes = result.value
-                logging.debug(f"Raw input length: {len(raw_bytes)} bytes")
+                logging.debug("Raw input length: %d bytes", len(raw_bytes))
                 return raw_bytes
             else:
                 err = getattr(result, 'error', None) if result else 'No response'
@@ -187,8 +188,8 @@ class EtherIPClient:
 
         readings: Dict[str, Optional[float]] = {}
         for name, ai_tag in self.channels.items():
-            start, end = self.offsets.get(ai_tag, (None, None))
-            if start is not None and end is not None and end < len(raw_bytes):
+            start, end = ai_offset(ai_tag, self.slot_size)
+            if end < min(len(raw_bytes), self.num_slots * self.slot_size):
                 value = self.decode_float(raw_bytes, start, end)
                 readings[name] = value
             else:
@@ -209,8 +210,8 @@ class EtherIPClient:
             "status_ch4": "AI27",
         }
         for name, ai_tag in status_mappings.items():
-            start, end = self.offsets.get(ai_tag, (None, None))
-            if start is not None and end is not None and end < len(raw_bytes):
+            start, end = ai_offset(ai_tag, self.slot_size)
+            if end < min(len(raw_bytes), self.num_slots * self.slot_size):
                 status_value = self.decode_uint(raw_bytes, start, end)
                 if status_value is None:
                     statuses[name] = None
@@ -233,7 +234,7 @@ class EtherIPClient:
         try:
             while True:
                 readings = self.read_all_channels()
-                logging.info(f"Current readings: {readings}")
+                logging.info("Current readings: %s", readings)
                 time.sleep(interval)
         except KeyboardInterrupt:
             logging.info("Health check loop interrupted by user.")
@@ -4,9 +4,14 @@ import asyncio
 import sys
 from asyncua import Client
 
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+
 # Load config.yaml
 with open("config.yaml", "r") as f:
-    config = yaml.safe_load(f)
+    config = yaml.load(f, Loader=_YamlLoader)
 
 opcua_endpoint = config["opcua"]["endpoint"]
 ethernetip_ip = config["ethernetip"]["ip_address"]
@@ -46,3 +51,4 @@ async def main():
         sys.exit(1)
 
 if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,11 +1,24 @@
 import asyncio
+import concurrent.futures
 import yaml
 import logging
 import signal
 import sys
+import threading
+import time
 from etherip_client import EtherIPClient
 from opcua_client import OPCUAClient
 
+try:
+    from yaml import CSafeLoader as _YamlLoader  # libyaml-backed, much faster
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+
+try:
+    import uvloop  # libuv-based event loop, not available on Windows
+except ImportError:
+    uvloop = None
+
 
 
 import logging.handlers
@@ -50,56 +63,90 @@ fh.setFormatter(formatter)
 logger.addHandler(fh)
 
 # Graceful shutdown handler
-stop_event = asyncio.Event()
-
-def shutdown_handler(sig, frame):
+def _request_shutdown(stop_event: asyncio.Event):
     logging.info("Shutdown signal received. Stopping...")
     stop_event.set()
 
-signal.signal(signal.SIGINT, shutdown_handler)
-signal.signal(signal.SIGTERM, shutdown_handler)
+def _install_signal_handlers(loop: asyncio.AbstractEventLoop, stop_event: asyncio.Event):
+    """Set stop_event on SIGINT/SIGTERM from within the event loop."""
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, _request_shutdown, stop_event)
+        except NotImplementedError: # e.g. Windows event loops
+            signal.signal(sig, lambda signum, frame: loop.call_soon_threadsafe(_request_shutdown, stop_event))
+
+# Interval between two EtherNet/IP reads (seconds)
+POLL_INTERVAL = 1.0
+
+def _put_latest(queue: asyncio.Queue, data):
+    """Put data into the queue, dropping a stale entry the consumer has not picked up yet."""
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(data)
+
+def _poll_loop(etherip_client: EtherIPClient, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue, poll_stop: threading.Event):
+    """Producer loop on the CIP worker thread: does the blocking CIP I/O and hands (readings, statuses) to the event loop."""
+    # Fixed cadence on the monotonic clock: the CIP round trip is absorbed by the wait
+    next_tick = time.monotonic()
+    while not poll_stop.is_set():
+        try:
+            data = etherip_client.read_all()
+        except Exception as e:
+            logging.error("Error reading EtherNet/IP data: %s", e, exc_info=True)
+        else:
+            try:
+                loop.call_soon_threadsafe(_put_latest, queue, data)
+            except RuntimeError: # Event loop already closed
+                break
+        next_tick += POLL_INTERVAL
+        delay = next_tick - time.monotonic()
+        if delay < 0:
+            # Overran the budget: restart the schedule from now instead of firing catch-up reads
+            logging.warning("Poll cycle overran its %.1f s interval by %.3f s.", POLL_INTERVAL, -delay)
+            next_tick = time.monotonic()
+            delay = 0.0
+        poll_stop.wait(delay)
 
 # New helper function for the main loop logic
-async def _run_main_loop(etherip_client: EtherIPClient, opc_client: OPCUAClient, stop_event: asyncio.Event):
+async def _run_main_loop(queue: asyncio.Queue, opc_client: OPCUAClient, stop_event: asyncio.Event):
     """Helper function to run the main data exchange loop."""
     try:
         while not stop_event.is_set():
-            # Run synchronous blocking I/O in a separate thread
-            readings = await asyncio.to_thread(etherip_client.read_all_channels)
+            # Readings come from the poll thread; one assembly read serves both views.
+            readings, statuses = await queue.get()
             
-            if stop_event.is_set(): # Added check after first blocking call
+            if stop_event.is_set(): # Added check after waiting for data
                 break
 
-            statuses = await asyncio.to_thread(etherip_client.read_channel_statuses)
+            # One liveness probe per cycle; reconnects only if the session is really gone
+            if not await opc_client.ensure_connected():
+                logging.warning("OPC UA server not reachable. Skipping this cycle's writes.")
+                continue
             
-            if stop_event.is_set(): # Added check after second blocking call
-                break
-            
-            all_data = {**readings, **statuses}
-            logging.debug(f"Read data: {all_data}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logging.debug("Read data: %s", {**readings, **statuses})
+
+            # Build the write batch straight from both views; no intermediate merged dict
+            all_data_filtered = {name: value for view in (readings, statuses)
+                                 for name, value in view.items() if value is not None}
+            # The watchdog heartbeat rides in the same Write request as the data
+            all_data_filtered[opc_client.WATCHDOG_NODE] = opc_client.next_watchdog_value()
+
+            # One OPC UA Write request for all changed values instead of one per node
+            results = await opc_client.write_values(all_data_filtered)
+            successful_writes = failed_writes = 0
+            for name, result in results.items():
+                if result is True:
+                    successful_writes += 1
+                else:
+                    failed_writes += 1
+                    if result is not None: # None: not sent, already logged by the client
+                        logging.warning("Write to %s failed: %r", name, result)
+            if successful_writes > 0:
+                logging.debug("Successfully wrote %d values to OPC UA server.", successful_writes)
+            if failed_writes > 0:
+                logging.warning("Failed to write %d values to OPC UA server.", failed_writes)
 
-            write_tasks = []
-            for name, value in all_data.items():
-                if value is not None:
-                    write_tasks.append(opc_client.write_value(name, value))
-            
-            if write_tasks:
-                results = await asyncio.gather(*write_tasks, return_exceptions=True)
-                successful_writes = sum(1 for r in results if r is True)
-                failed_writes = sum(1 for r in results if r is False)
-                if successful_writes > 0:
-                    logging.debug(f"Successfully wrote {successful_writes} values to OPC UA server.")
-                if failed_writes > 0:
-                    logging.warning(f"Failed to write {failed_writes} values to OPC UA server.")
-                
-            if stop_event.is_set(): # Added check before watchdog toggle
-                break
-
-            if not await opc_client.toggle_watchdog():
-                logging.warning("Failed to toggle OPC UA watchdog.")
-
-            # This sleep is responsive to cancellation, no need for check after it
-            await asyncio.sleep(1) 
     except asyncio.CancelledError:
         logging.info("Data exchange loop task cancelled.")
     except Exception as e:
@@ -109,33 +156,51 @@ async def _run_main_loop(etherip_client: EtherIPClient, opc_client: OPCUAClient,
 async def main():
     # Load configuration
     with open("config.yaml", "r") as f:
-        config = yaml.safe_load(f)
+        config = yaml.load(f, Loader=_YamlLoader)
 
     opc_endpoint = config["opcua"]["endpoint"]
     node_ids = config["opcua"]["nodes"]
+    rel_tol = config["opcua"].get("dedupe_rel_tol", OPCUAClient.FLOAT_REL_TOL)
+    abs_tol = config["opcua"].get("dedupe_abs_tol", OPCUAClient.FLOAT_ABS_TOL)
     eth_ip = config["ethernetip"]["ip_address"]
     eds_file = config["ethernetip"]["eds_file"]
+    connected_messaging = config["ethernetip"].get("connected_messaging", False)
+    read_cache_ms = config["ethernetip"].get("read_cache_ms", 0)
+
+    # Graceful shutdown: the event belongs to the running loop, signals are delivered through it
+    loop = asyncio.get_running_loop()
+    stop_event = asyncio.Event()
+    _install_signal_handlers(loop, stop_event)
+
+    # All CIP driver use (connect, polling, close) runs on one dedicated worker thread:
+    # the driver is not safe for concurrent use, and the default executor is shared.
+    etherip_exec = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="etherip")
 
     # Initialize EtherNet/IP client
-    etherip_client = EtherIPClient(ip_address=eth_ip, eds_file=eds_file)
-    # Connect EtherNet/IP with retry logic
-    while not await asyncio.to_thread(etherip_client.connect):
-        await asyncio.sleep(1) # Small delay before checking connect again (connect method has its own delays)
-    
+    etherip_client = EtherIPClient(ip_address=eth_ip, eds_file=eds_file, connected_messaging=connected_messaging,
+                                   read_cache_ms=read_cache_ms)
     # Initialize OPC UA client
-    opc_client = OPCUAClient(opc_endpoint, node_ids)
-    # Connect OPC UA with retry logic
-    while not await opc_client.connect():
-        await asyncio.sleep(1) # Small delay before checking connect again (connect method has its own delays)
+    opc_client = OPCUAClient(opc_endpoint, node_ids, rel_tol=rel_tol, abs_tol=abs_tol)
 
-    logging.info("Starting data exchange loop... Press Ctrl+C to stop.")
-    
-    # Create the main data exchange loop as a cancellable task
-    main_task = asyncio.create_task(_run_main_loop(etherip_client, opc_client, stop_event)) # New helper function
+    data_queue = asyncio.Queue(maxsize=1)
+    poll_stop = threading.Event()
+    poll_future = None
+    main_task = None
 
     try:
-        # Wait until stop_event is set (from signal handler)
-        await stop_event.wait() 
+        # Connect both endpoints with exponential backoff; a shutdown signal aborts the wait
+        if (await etherip_client.connect_with_backoff(stop_event, etherip_exec)
+                and await opc_client.connect_with_backoff(stop_event)):
+            logging.info("Starting data exchange loop... Press Ctrl+C to stop.")
+
+            # Run the EtherNet/IP poll loop on the CIP worker; it feeds the data exchange loop through the queue
+            poll_future = loop.run_in_executor(etherip_exec, _poll_loop, etherip_client, loop, data_queue, poll_stop)
+
+            # Create the main data exchange loop as a cancellable task
+            main_task = asyncio.create_task(_run_main_loop(data_queue, opc_client, stop_event)) # New helper function
+
+            # Wait until stop_event is set (from signal handler)
+            await stop_event.wait()
     except asyncio.CancelledError:
         logging.info("Main task cancelled (likely due to signal).")
     except Exception as e:
@@ -143,20 +208,32 @@ async def main():
     finally:
         logging.info("Cleaning up...")
         # Ensure the main task is truly cancelled and finished
-        if not main_task.done():
+        if main_task is not None and not main_task.done():
             main_task.cancel()
             try:
                 await main_task # Await cancellation to propagate
             except asyncio.CancelledError:
                 pass # Expected during cancellation
 
+        # Stop the poll loop; the driver is closed on the same worker once it has returned
+        poll_stop.set()
+        if poll_future is not None:
+            await asyncio.wait([poll_future], timeout=etherip_client.timeout + POLL_INTERVAL)
+
         # Ensure proper disconnect based on connection status
         # This part remains mostly the same, as we're explicitly disconnecting clients
         if opc_client.client and opc_client._is_connected:
             await opc_client.disconnect()
-        if etherip_client.driver and etherip_client.driver.connected:
-            etherip_client.driver.close()
+        await loop.run_in_executor(etherip_exec, etherip_client.close)
+        etherip_exec.shutdown(wait=False)
         logging.info("Shutdown complete.")
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if uvloop is None:
+        asyncio.run(main())
+    elif sys.version_info >= (3, 11):
+        with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+            runner.run(main())
+    else:
+        uvloop.install()
+        asyncio.run(main())
\ No newline at end of file
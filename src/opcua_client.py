@@ -1,16 +1,59 @@
 import asyncio
 import logging
+import math
 from asyncua import Client, ua
+from retry import retry_with_backoff
 import time
 
 
+# Python conversion applied to values written to nodes of a given VariantType
+COERCE_BY_VARIANT_TYPE = {
+    ua.VariantType.Boolean: bool,
+    ua.VariantType.Int16: int,
+    ua.VariantType.Int32: int,
+    ua.VariantType.Int64: int,
+    ua.VariantType.UInt16: int,
+    ua.VariantType.UInt32: int,
+    ua.VariantType.UInt64: int,
+    ua.VariantType.Float: float,
+    ua.VariantType.Double: float,
+    ua.VariantType.String: str,
+}
+
+# Status codes meaning the session or secure channel is gone and a reconnect is required
+SESSION_LOST_CODES = frozenset({
+    ua.StatusCodes.BadSessionIdInvalid,
+    ua.StatusCodes.BadSessionClosed,
+    ua.StatusCodes.BadSessionNotActivated,
+    ua.StatusCodes.BadSecureChannelIdInvalid,
+    ua.StatusCodes.BadSecureChannelClosed,
+    ua.StatusCodes.BadConnectionClosed,
+    ua.StatusCodes.BadServerNotConnected,
+    ua.StatusCodes.BadNotConnected,
+})
+
+def _as_is(value):
+    return value
+
+
 class OPCUAClient:
-    def __init__(self, endpoint: str, node_ids: dict):
+    # Default tolerances (math.isclose) below which a float counts as unchanged and is not written again
+    FLOAT_REL_TOL = 1e-4
+    FLOAT_ABS_TOL = 1e-6
+    # Seconds to wait for the ServerStatus liveness probe
+    PROBE_TIMEOUT = 2.0
+    # Heartbeat node; it is written every cycle and never deduplicated
+    WATCHDOG_NODE = "watchdog"
+
+    def __init__(self, endpoint: str, node_ids: dict, rel_tol: float = FLOAT_REL_TOL, abs_tol: float = FLOAT_ABS_TOL):
         """
         Initialize OPC UA client with endpoint and node mapping.
+        rel_tol/abs_tol set how far a float must move from the last written value to be written again.
         """
         self.endpoint = endpoint
         self.node_ids = node_ids
+        self.rel_tol = rel_tol
+        self.abs_tol = abs_tol
         self.client = Client(url=self.endpoint)
         self.nodes = {}
         self.node_datatypes = {} # New: Store expected data types
@@ -18,6 +61,8 @@ class OPCUAClient:
         self.reconnect_attempts = 0
         self.last_reconnect_time = 0
         self._is_connected = False # Custom connection state variable
+        self._last_written = {} # Last value successfully written per node (dirty-bit filtering)
+        self._write_templates = {} # Per node: (coerce function, VariantType, NodeId), built on connect
 
     async def connect(self):
         """
@@ -49,21 +94,23 @@ class OPCUAClient:
             await self.client.connect()
             logging.info(f"Connected to OPC UA server at {self.endpoint} after {self.reconnect_attempts} attempts.")
             self._is_connected = True # Set custom variable to True on success
+            self._last_written.clear() # Fresh session: write everything once
             
-            # Resolve node references and query data types
-            for name, node_id in self.node_ids.items():
-                node = self.client.get_node(node_id)
-                self.nodes[name] = node
-                
-                # Query and store the expected DataType
-                try:
-                    expected_variant_type = await node.read_data_type_as_variant_type()
-                    self.node_datatypes[name] = expected_variant_type
-                    logging.debug(f"Node {name} ({node_id}) expects VariantType: {expected_variant_type}")
-                except Exception as dt_e:
-                    logging.warning(f"Could not determine expected VariantType for node {name} ({node_id}): {dt_e}. Will infer from Python type at write time.")
+            # Resolve node references and query all expected DataTypes concurrently
+            self.nodes = {name: self.client.get_node(node_id) for name, node_id in self.node_ids.items()}
+            variant_types = await asyncio.gather(
+                *(node.read_data_type_as_variant_type() for node in self.nodes.values()),
+                return_exceptions=True,
+            )
+            for (name, node_id), expected_variant_type in zip(self.node_ids.items(), variant_types):
+                if isinstance(expected_variant_type, Exception):
+                    logging.warning(f"Could not determine expected VariantType for node {name} ({node_id}): {expected_variant_type}. Will infer from Python type at write time.")
                     self.node_datatypes[name] = None
+                else:
+                    self.node_datatypes[name] = expected_variant_type
+                    logging.debug("Node %s (%s) expects VariantType: %s", name, node_id, expected_variant_type)
                     
+            self._build_write_templates()
             logging.info(f"Resolved {len(self.nodes)} OPC UA nodes.")
             self.reconnect_attempts = 0 # Reset on success
             self.last_reconnect_time = 0
@@ -73,6 +120,18 @@ class OPCUAClient:
             self._is_connected = False # Set custom variable to False on failure
             return False
 
+    async def connect_with_backoff(self, stop_event: asyncio.Event) -> bool:
+        """
+        Connect with exponential backoff (see retry.retry_with_backoff) until it succeeds.
+        Returns False if stop_event is set first.
+        """
+        async def attempt():
+            # The backoff sets the pace here, not the retry throttle inside connect()
+            self.last_reconnect_time = 0
+            return await self.connect()
+
+        return await retry_with_backoff(attempt, stop_event, f"OPC UA server at {self.endpoint}")
+
     async def write_value(self, name: str, value):
         """
         Write a value to an OPC UA node with an explicit data type, ensuring connection is active.
@@ -85,57 +144,160 @@ class OPCUAClient:
                 return False
 
         try:
-            node = self.nodes.get(name)
-            if node:
-                expected_variant_type = self.node_datatypes.get(name)
-                typed_value = value # Default to original value
-
-                # Apply type conversion based on expected_variant_type
-                if expected_variant_type == ua.VariantType.Boolean:
-                    typed_value = bool(value)
-                elif expected_variant_type in (ua.VariantType.Int16, ua.VariantType.Int32, ua.VariantType.Int64, ua.VariantType.UInt16, ua.VariantType.UInt32, ua.VariantType.UInt64):
-                    typed_value = int(value)
-                elif expected_variant_type in (ua.VariantType.Float, ua.VariantType.Double):
-                    typed_value = float(value)
-                elif expected_variant_type == ua.VariantType.String:
-                    typed_value = str(value)
-                else: # Fallback to original type inference if type is unknown or None
-                    if expected_variant_type is None: # Only warn if we explicitly failed to get type
-                        logging.warning(f"No specific VariantType determined for node {name}. Inferring from Python type.")
-
-                # If expected_variant_type is None, ua.Variant will infer.
-                variant = ua.Variant(typed_value, expected_variant_type if expected_variant_type else None)
-                
-                await node.write_value(ua.DataValue(variant))
-                logging.debug(f"Updated {name} with value {typed_value} (original: {value}) as VariantType: {expected_variant_type}")
+            if name in self._write_templates:
+                # Send a WriteValue built from the node's resolved template straight through the
+                # Write service instead of going through Node.write_value's per-call conversion
+                write_value = self._stamp(name, value)
+                status_codes = await self.client.uaclient.write(ua.WriteParameters(NodesToWrite=[write_value]))
+                status_codes[0].check()
+                variant = write_value.Value.Value
+                self._last_written[name] = value
+                logging.debug("Updated %s with value %r (original: %r) as VariantType: %s",
+                              name, variant.Value, value, variant.VariantType)
                 return True # Indicate success
             else:
                 logging.error(f"Node {name} not found in mapping.")
                 return False # Indicate failure
         except Exception as e:
-            # If a write fails even when is_connected was True, it might mean the connection just dropped.
-            # Disconnect to force a reconnect attempt on next cycle.
-            logging.error(f"Error writing to node {name}: {e}. Disconnecting to force reconnect.")
-            try:
-                await self.client.disconnect()
-            except Exception as disconnect_e:
-                logging.warning(f"Error during forced disconnect: {disconnect_e}")
-            self._is_connected = False # Set custom variable to False on failure
+            await self._handle_write_error(f"node {name}", e)
             return False
 
+    async def write_values(self, name_value_pairs: dict):
+        """
+        Write several values with a single OPC UA Write service call instead of one request per node.
+        Values unchanged since the last successful write are skipped (see changed_values).
+        Returns a dict mapping each name that had to be written to True if it was written, otherwise
+        to the failure reason: the bad StatusCode returned by the server, the exception raised by
+        the Write call, or None if the value was never sent (not connected, unknown node).
+        """
+        name_value_pairs = self.changed_values(name_value_pairs)
+        results = dict.fromkeys(name_value_pairs)
+        if not name_value_pairs:
+            return results
+        if not self._is_connected: # Check using our custom variable
+            logging.warning("OPC UA client not connected. Attempting to reconnect before batch write.")
+            if not await self.connect(): # self.connect() handles the delays and retries
+                logging.error("Failed to establish/reconnect OPC UA server. Cannot write batch.")
+                return results
+
+        names = []
+        nodes_to_write = []
+        for name, value in name_value_pairs.items():
+            if name not in self._write_templates:
+                logging.error(f"Node {name} not found in mapping.")
+                continue
+            names.append(name)
+            nodes_to_write.append(self._stamp(name, value))
+
+        if not nodes_to_write:
+            return results
+
+        try:
+            status_codes = await self.client.uaclient.write(ua.WriteParameters(NodesToWrite=nodes_to_write))
+        except Exception as e:
+            await self._handle_write_error(f"batch of {len(nodes_to_write)} values", e)
+            results.update(dict.fromkeys(names, e))
+            return results
+
+        for name, status in zip(names, status_codes):
+            if status.is_good():
+                results[name] = True
+                self._last_written[name] = name_value_pairs[name]
+            else:
+                results[name] = status
+        logging.debug("Wrote %d values in one Write request.", len(nodes_to_write))
+        return results
 
-    async def toggle_watchdog(self):
+    def changed_values(self, items: dict) -> dict:
         """
-        Toggles the watchdog node between True and False.
-        Returns True if successful, False otherwise.
+        Return only the items whose value differs from the last value written to the node.
+        Floats count as changed unless math.isclose() with rel_tol/abs_tol considers them equal.
+        The watchdog is always kept: a skipped heartbeat would look like a stalled bridge.
         """
-        self.watchdog_state = not self.watchdog_state
-        success = await self.write_value("watchdog", self.watchdog_state)
-        if success:
-            logging.debug(f"Toggled watchdog to {self.watchdog_state}")
+        changed = {}
+        for name, value in items.items():
+            if name == self.WATCHDOG_NODE or name not in self._last_written:
+                changed[name] = value
+                continue
+            last = self._last_written[name]
+            if isinstance(value, float) and isinstance(last, float):
+                if not math.isclose(value, last, rel_tol=self.rel_tol, abs_tol=self.abs_tol): # NaN is never close
+                    changed[name] = value
+            elif value != last:
+                changed[name] = value
+        return changed
+
+    def _build_write_templates(self):
+        """
+        Resolve the coercion function, VariantType and NodeId per node once after connect,
+        so a write only has to convert the value and build its WriteValue.
+        """
+        self._write_templates = {}
+        for name, node in self.nodes.items():
+            variant_type = self.node_datatypes.get(name)
+            if variant_type is None: # Only warn if we explicitly failed to get type
+                logging.warning(f"No specific VariantType determined for node {name}. Inferring from Python type at write time.")
+            coerce = COERCE_BY_VARIANT_TYPE.get(variant_type, _as_is)
+            self._write_templates[name] = (coerce, variant_type, node.nodeid)
+
+    def _stamp(self, name: str, value):
+        """
+        Return a new WriteValue for the node carrying value, converted to the node's data type.
+        If the VariantType is unknown, ua.Variant infers it from the Python type.
+        A fresh object per write keeps overlapping requests to the same node independent.
+        """
+        coerce, variant_type, nodeid = self._write_templates[name]
+        return ua.WriteValue(
+            NodeId=nodeid,
+            AttributeId=ua.AttributeIds.Value,
+            Value=ua.DataValue(ua.Variant(coerce(value), variant_type)),
+        )
+
+    async def ensure_connected(self):
+        """
+        Make sure the session is usable before a cycle's writes.
+        A live session is verified with one ServerStatus/State read; only if that probe
+        fails is the session torn down and rebuilt. Returns True if connected.
+        """
+        if self._is_connected:
+            try:
+                state_node = self.client.get_node(ua.NodeId(ua.ObjectIds.Server_ServerStatus_State))
+                await asyncio.wait_for(state_node.read_value(), self.PROBE_TIMEOUT)
+                return True
+            except Exception as e:
+                logging.warning(f"OPC UA liveness probe failed: {e}. Reconnecting.")
+                await self._force_disconnect()
+        return await self.connect()
+
+    async def _handle_write_error(self, target: str, e: Exception):
+        """
+        Drop the session only if the error says it is gone; anything else is left to the
+        next liveness probe so a transient error does not force a full reconnect.
+        """
+        if isinstance(e, ua.UaStatusCodeError) and e.code in SESSION_LOST_CODES:
+            logging.error(f"Error writing to {target}: {e}. Session lost, disconnecting to force reconnect.")
+            await self._force_disconnect()
         else:
-            logging.error(f"Failed to toggle watchdog to {self.watchdog_state}")
-        return success
+            logging.error(f"Error writing to {target}: {e}")
+
+    async def _force_disconnect(self):
+        """
+        Drop the session after a failed write so the next cycle reconnects.
+        """
+        try:
+            await self.client.disconnect()
+        except Exception as disconnect_e:
+            logging.warning(f"Error during forced disconnect: {disconnect_e}")
+        self._is_connected = False # Set custom variable to False on failure
+        self._last_written.clear()
+
+
+    def next_watchdog_value(self) -> bool:
+        """
+        Flip the watchdog state and return the value to write in this cycle's batch.
+        """
+        self.watchdog_state = not self.watchdog_state
+        return self.watchdog_state
 
 
     async def disconnect(self):
@@ -1,13 +1,15 @@
 """
 A simple OPC UA server for testing purposes.
 It creates nodes for conductivity, temperature, and status for 4 channels.
+
+The bridge only writes values that changed. Consumers should not poll these nodes
+but create a subscription with monitored items on them; the default
+DataChangeFilter (trigger StatusValue) then delivers only actual changes.
 """
 import asyncio
 import logging
 from asyncua import Server, ua
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
-
 async def main():
     _logger = logging.getLogger(__name__)
     # setup our server
@@ -48,12 +50,14 @@ async def main():
         "WATCHDOG": ua.Variant(False, ua.VariantType.Boolean),
     }
 
-    _logger.info("Creating OPC UA nodes...")
-    for name, variant in node_definitions.items():
+    async def create_node(name, variant):
         new_var = await device_obj.add_variable(f"ns={idx};s={name}", name, variant)
         await new_var.set_writable(True)
         _logger.info(f"  - Created node: ns={idx};s={name}")
 
+    _logger.info("Creating OPC UA nodes...")
+    await asyncio.gather(*(create_node(name, variant) for name, variant in node_definitions.items()))
+
 
     _logger.info("Starting OPC UA server at opc.tcp://0.0.0.0:4840")
     async with server:
@@ -61,6 +65,8 @@ async def main():
             await asyncio.sleep(1)
 
 if __name__ == "__main__":
+    # Configure logging only when run as a script, never on import
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
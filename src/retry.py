@@ -0,0 +1,25 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+# Upper bound (seconds) for the delay between two connection attempts
+MAX_BACKOFF = 300
+
+
+async def retry_with_backoff(connect: Callable[[], Awaitable[bool]], stop_event: asyncio.Event, name: str) -> bool:
+    """
+    Await connect() until it returns True, waiting 1, 2, 4 ... MAX_BACKOFF seconds between attempts.
+    Returns False if stop_event is set first; the wait is cut short as soon as it is.
+    """
+    attempt = 0
+    while not stop_event.is_set():
+        if await connect():
+            return True
+        delay = min(2 ** attempt, MAX_BACKOFF)
+        attempt += 1
+        logging.info("Retrying connection to %s in %d seconds.", name, delay)
+        try:
+            await asyncio.wait_for(stop_event.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+    return False